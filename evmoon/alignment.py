@@ -0,0 +1,163 @@
+import datetime
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MIN_PERIODS = 2
+
+
+def business_day_calendar(start_period: datetime.date,
+                          end_period: datetime.date,
+                          holidays: Iterable[datetime.date] = None) -> pd.DatetimeIndex:
+    holidays = list(holidays) if holidays is not None else []
+    return pd.bdate_range(start_period, end_period, freq='C', holidays=holidays)
+
+
+def align_price_data_frame(df_price: pd.DataFrame,
+                           calendar: pd.DatetimeIndex = None,
+                           ffill_limit: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """価格データを揃え、(揃えた価格, 実際に観測された値かどうかのマスク) を返す.
+
+    calendar を指定した場合はその日付に揃える (カレンダー外の日付は除かれる).
+    ffill_limit > 0 の場合は連続 ffill_limit 日までの欠損を直前の価格で埋める.
+    上場前・欠損の続く期間は NaN のまま残すので、ファンドごとに利用可能な期間が異なってもよい.
+    """
+    assert ffill_limit >= 0, 'ffill_limit must be >= 0'
+
+    if calendar is not None:
+        df_price = df_price.copy()
+        df_price.index = pd.to_datetime(df_price.index)
+        df_price = df_price.reindex(calendar)
+
+    df_observed = df_price.notna()
+
+    if ffill_limit > 0:
+        df_price = df_price.ffill(limit=ffill_limit)
+
+    return df_price, df_observed
+
+
+class PairwiseMoments:
+    """ファンドの組ごとに、双方の値が揃っている期間 (pairwise-complete) で平均・共分散を計算する.
+
+    十分統計量 (組ごとの件数・和・積和) をマスク付きの行列演算で保持するので、
+    ファンドを追加しても既存のファンドのサンプルは減らず、追加分の行・列だけを計算すればよい.
+    """
+
+    def __init__(self, df_return: pd.DataFrame):
+        self._df_return = df_return.astype(float)
+
+        values, mask = _masked_values(self._df_return.values)
+        self._counts = mask.T @ mask
+        self._sums = values.T @ mask        # _sums[i, j]: i, j 両方が揃っている期間の i の和
+        self._products = values.T @ values
+
+    @property
+    def fund_codes(self) -> list:
+        return list(self._df_return.columns)
+
+    def copy(self) -> 'PairwiseMoments':
+        ret = PairwiseMoments.__new__(PairwiseMoments)
+        ret._df_return = self._df_return
+        ret._counts = self._counts.copy()
+        ret._sums = self._sums.copy()
+        ret._products = self._products.copy()
+        return ret
+
+    def add(self, ser_return: pd.Series) -> None:
+        fund_code = ser_return.name
+        if fund_code in self._df_return.columns:
+            raise ValueError("Fund '{}' is already added.".format(fund_code))
+
+        # 新しいファンドにしかない日付が増えても、既存のファンドはその日付で NaN になるだけなので統計量は変わらない
+        index = self._df_return.index.union(ser_return.index)
+        df_return = self._df_return.reindex(index)
+        values, mask = _masked_values(df_return.values)
+        new_values, new_mask = _masked_values(ser_return.reindex(index).astype(float).values)
+
+        self._counts = _extend(self._counts, mask.T @ new_mask, mask.T @ new_mask, new_mask @ new_mask)
+        self._sums = _extend(self._sums, values.T @ new_mask, mask.T @ new_values, new_values @ new_mask)
+        self._products = _extend(self._products, values.T @ new_values, values.T @ new_values,
+                                 new_values @ new_values)
+
+        df_return[fund_code] = ser_return.reindex(index).astype(float)
+        self._df_return = df_return
+
+    def counts(self) -> pd.DataFrame:
+        return pd.DataFrame(self._counts, index=self.fund_codes, columns=self.fund_codes)
+
+    def mean(self) -> pd.Series:
+        # 平均はファンドごとに利用可能な全期間で計算する
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.diag(self._sums) / np.diag(self._counts)
+        return pd.Series(mean, index=self.fund_codes)
+
+    def cov(self, ddof: int = 0, min_periods: int = 1) -> pd.DataFrame:
+        # 揃っている期間が min_periods 未満の組は NaN とする
+        n = self._counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = (self._products - self._sums * self._sums.T / n) / (n - ddof)
+        cov[(n - ddof <= 0) | (n < min_periods)] = np.nan
+        return pd.DataFrame(cov, index=self.fund_codes, columns=self.fund_codes)
+
+
+def calc_mean_cov_for_optimization(df_return: pd.DataFrame,
+                                   min_periods: int = DEFAULT_MIN_PERIODS,
+                                   ddof: int = 0) -> Tuple[pd.Series, pd.DataFrame, list]:
+    """最適化に使える (平均, 共分散, 除外したファンド) を返す.
+
+    pairwise-complete の共分散行列は欠損のある組を含んだり、半正定値にならなかったりするので、
+    サンプルの足りないファンドを除いたうえで最も近い半正定値行列に射影する.
+    """
+    return calc_mean_cov_from_moments(PairwiseMoments(df_return), min_periods, ddof)
+
+
+def calc_mean_cov_from_moments(moments: PairwiseMoments,
+                               min_periods: int = DEFAULT_MIN_PERIODS,
+                               ddof: int = 0) -> Tuple[pd.Series, pd.DataFrame, list]:
+    # 計算済みの統計量から calc_mean_cov_for_optimization と同じ結果を返す
+    ser_mean = moments.mean()
+    df_cov = moments.cov(ddof, min_periods)
+    ser_count = pd.Series(np.diag(moments.counts().values), index=moments.fund_codes)
+
+    # 自身の分散すら計算できないファンドを除く
+    usable = ser_mean.notna() & pd.Series(np.diag(df_cov.values), index=moments.fund_codes).notna()
+    df_cov = df_cov.loc[usable, usable]
+
+    # 揃っている期間の足りない組が残っていれば、欠損の多い (同数ならサンプルの少ない) ファンドから除く
+    while df_cov.isna().values.any():
+        ser_num_nan = df_cov.isna().sum()
+        order = np.lexsort((ser_count[df_cov.index].values, -ser_num_nan.values))
+        fund_code = df_cov.index[order[0]]
+        df_cov = df_cov.drop(index=fund_code, columns=fund_code)
+
+    fund_codes = list(df_cov.index)
+    excluded = [fund_code for fund_code in moments.fund_codes if fund_code not in fund_codes]
+    return ser_mean[fund_codes], nearest_psd(df_cov), excluded
+
+
+def nearest_psd(df_cov: pd.DataFrame) -> pd.DataFrame:
+    # 負の固有値を 0 に切り上げる (フロベニウスノルムで最も近い半正定値行列)
+    if df_cov.empty:
+        return df_cov
+
+    values = (df_cov.values + df_cov.values.T) / 2
+    eigenvalues, eigenvectors = np.linalg.eigh(values)
+    psd = (eigenvectors * np.clip(eigenvalues, 0.0, None)) @ eigenvectors.T
+    return pd.DataFrame((psd + psd.T) / 2, index=df_cov.index, columns=df_cov.columns)
+
+
+def _masked_values(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    mask = ~np.isnan(values)
+    return np.where(mask, values, 0.0), mask.astype(float)
+
+
+def _extend(matrix: np.ndarray, col: np.ndarray, row: np.ndarray, corner: float) -> np.ndarray:
+    k = matrix.shape[0]
+    ret = np.empty((k + 1, k + 1))
+    ret[:k, :k] = matrix
+    ret[:k, k] = col
+    ret[k, :k] = row
+    ret[k, k] = corner
+    return ret
@@ -7,7 +7,7 @@ import pandas as pd
 import numpy as np
 from scipy import optimize
 
-from evmoon import data
+from evmoon import alignment, data
 
 REQUEST_INTERVAL_SEC = 2
 
@@ -55,30 +55,52 @@ def get_price_data_frame(fund_codes: list,
 def calc_rate_of_return(fund_codes: list,
                         start_period: datetime.date = None,
                         end_period: datetime.date = None,
-                        investment_period_days: int = 5) -> pd.DataFrame:
+                        investment_period_days: int = 5,
+                        calendar: pd.DatetimeIndex = None,
+                        ffill_limit: int = 0) -> pd.DataFrame:
     assert investment_period_days > 0, 'investment_period_days must be > 0'
 
     df_price = get_price_data_frame(fund_codes, start_period, end_period)
-    sers = {}
+    return calc_rate_of_return_from_price(df_price, investment_period_days, calendar, ffill_limit)
 
-    for fund_code in fund_codes:
-        ser = df_price[fund_code]
-        ser_shifted = ser.shift(investment_period_days)
-        ser_shifted.name = fund_code + '_shifted'
-        df_shifted = pd.concat([ser_shifted, ser], axis=1)
 
-        sers[fund_code] = df_shifted.apply(lambda x: (x[1] - x[0]) / x[0], axis=1)
+def calc_rate_of_return_from_price(df_price: pd.DataFrame,
+                                   investment_period_days: int = 5,
+                                   calendar: pd.DatetimeIndex = None,
+                                   ffill_limit: int = 0) -> pd.DataFrame:
+    assert investment_period_days > 0, 'investment_period_days must be > 0'
+
+    df_price, df_observed = alignment.align_price_data_frame(df_price, calendar, ffill_limit)
+    df_shifted = df_price.shift(investment_period_days)
+    df_return = (df_price - df_shifted) / df_shifted
+
+    # 期末の価格が前日から埋めた値の場合は 0% の見せかけの収益率になるので除く.
+    # 期首は直前に観測された価格なので、埋めた値でもそのまま使う
+    df_return = df_return.where(df_observed)
 
-    return pd.concat(sers, axis=1).dropna()
+    # 上場日の異なるファンドがあっても他のファンドの期間を削らないよう、全ファンドが NaN の行だけ除く
+    return df_return.dropna(how='all')
 
 
 def calc_mean_std(fund_codes: list,
                   start_period: datetime.date = None,
                   end_period: datetime.date = None,
-                  investment_period_days: int = 5) -> pd.DataFrame:
-    df_return = calc_rate_of_return(fund_codes, start_period, end_period, investment_period_days)
-    ser_mean = df_return.mean()
-    ser_std = df_return.std(ddof=0)
+                  investment_period_days: int = 5,
+                  calendar: pd.DatetimeIndex = None,
+                  ffill_limit: int = 0,
+                  min_periods: int = alignment.DEFAULT_MIN_PERIODS) -> pd.DataFrame:
+    df_return = calc_rate_of_return(fund_codes, start_period, end_period, investment_period_days,
+                                    calendar, ffill_limit)
+    return calc_mean_std_from_return(df_return, min_periods)
+
+
+def calc_mean_std_from_return(df_return: pd.DataFrame,
+                              min_periods: int = alignment.DEFAULT_MIN_PERIODS) -> pd.DataFrame:
+    # NaN は除いて計算されるので、ファンドごとに利用可能な全期間の統計量になる.
+    # サンプルが min_periods 未満のファンドは (サンプル 1 つで標準偏差 0 になるなど) 信頼できないので NaN とする
+    has_enough_samples = df_return.count() >= min_periods
+    ser_mean = df_return.mean().where(has_enough_samples)
+    ser_std = df_return.std(ddof=0).where(has_enough_samples)
     df_ret = pd.concat({'mean': ser_mean, 'std': ser_std}, axis=1).sort_index()
     df_ret.index.name = 'fund_code'
     return df_ret
@@ -92,7 +114,7 @@ def _calc_portfolio_mean_std(weights: np.array, mean: np.array, cov: np.ndarray)
         i, j = it.multi_index
         p_var += weights[i] * weights[j] * it[0]
         it.iternext()
-    return p_mean, np.sqrt(p_var)
+    return p_mean, np.sqrt(max(p_var, 0.0))     # 丸め誤差で僅かに負になることがある
 
 
 def calc_random_weight_portfolios(num_iter: int, mean: np.array, cov: np.ndarray) -> np.ndarray:
@@ -125,7 +147,7 @@ def optimize_weights(expected_rate_of_returns: float,
             i, j = it.multi_index
             sum += weights[i] * weights[j] * it[0]
             it.iternext()
-        return np.sqrt(sum)
+        return np.sqrt(max(sum, 0.0))   # 丸め誤差で僅かに負になることがある
 
     # 重み和の制約
     def weight_sum_constraint(weights):
@@ -1,8 +1,11 @@
 import datetime
+import logging
 
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 
+from .alignment import DEFAULT_MIN_PERIODS, calc_mean_cov_for_optimization
 from .analysis import get_price_data_frame, calc_rate_of_return, calc_random_weight_portfolios
 
 
@@ -18,8 +21,11 @@ def show_price_chart(fund_codes: list,
 def show_rate_of_return_chart(fund_codes: list,
                               start_period: datetime.date = None,
                               end_period: datetime.date = None,
-                              investment_period_days: int = 5) -> None:
-    df_return = calc_rate_of_return(fund_codes, start_period, end_period, investment_period_days)
+                              investment_period_days: int = 5,
+                              calendar: pd.DatetimeIndex = None,
+                              ffill_limit: int = 0) -> None:
+    df_return = calc_rate_of_return(fund_codes, start_period, end_period, investment_period_days,
+                                    calendar, ffill_limit)
     ax = df_return.plot(title='Rate of Return of Funds', grid=True)
     ax.set_xlabel("Date")
     ax.set_ylabel("Rate of Return")
@@ -29,20 +35,28 @@ def show_mean_std_diagram_with_time_series(fund_codes: list,
                                            start_period: datetime.date = None,
                                            end_period: datetime.date = None,
                                            investment_period_days: int = 5,
-                                           num_random_feasible_set: int = 0) -> None:
-    df_return = calc_rate_of_return(fund_codes, start_period, end_period, investment_period_days)
-    matrix = df_return.as_matrix()
+                                           num_random_feasible_set: int = 0,
+                                           min_periods: int = DEFAULT_MIN_PERIODS,
+                                           calendar: pd.DatetimeIndex = None,
+                                           ffill_limit: int = 0) -> None:
+    df_return = calc_rate_of_return(fund_codes, start_period, end_period, investment_period_days,
+                                    calendar, ffill_limit)
+    ser_mean, df_cov, excluded = calc_mean_cov_for_optimization(df_return, min_periods)
+    if excluded:
+        logging.warning('Funds without enough samples are excluded: {}'.format(excluded))
 
-    mean = matrix.mean(axis=0)
-    cov = np.cov(matrix, rowvar=False, ddof=0)
+    # 共分散行列は半正定値に射影しており対角成分も変わるので、各ファンドの標準偏差は収益率から直接計算する
+    fund_codes = list(ser_mean.index)
+    stddev = df_return[fund_codes].std(ddof=0).values
 
-    show_mean_std_diagram(fund_codes, mean, cov, num_random_feasible_set)
+    show_mean_std_diagram(fund_codes, ser_mean.values, df_cov.values, num_random_feasible_set, stddev)
 
 
 def show_mean_std_diagram(fund_codes: list,
                           mean: np.ndarray,
                           cov: np.ndarray,
-                          num_random_feasible_set: int = 0) -> None:
+                          num_random_feasible_set: int = 0,
+                          stddev: np.ndarray = None) -> None:
     fig = plt.figure()
     ax = fig.add_subplot(111)
 
@@ -54,8 +68,9 @@ def show_mean_std_diagram(fund_codes: list,
         ax.scatter(x=portfolio_mean_std_weight[1], y=portfolio_mean_std_weight[0], c='lightskyblue', s=5, marker='o',
                    label='random feasible set')
 
-    # 各ファンドをプロット
-    stddev = np.sqrt(cov.diagonal())
+    # 各ファンドをプロット. stddev が与えられなければ共分散行列の対角成分から求める
+    if stddev is None:
+        stddev = np.sqrt(cov.diagonal())
     ax.scatter(x=stddev, y=mean, c='navy', s=16, marker='x', label='fund')
 
     for i, fund_code in enumerate(fund_codes):
@@ -0,0 +1,436 @@
+import datetime
+import json
+import logging
+import socketserver
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Hashable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from evmoon import alignment, analysis, data
+
+DEFAULT_INVESTMENT_PERIOD_DAYS = 5
+DEFAULT_NUM_FRONTIER_POINTS = 20
+MAX_NUM_FRONTIER_POINTS = 100   # 1 点ごとに最適化を実行するので上限を設ける
+DEFAULT_CACHE_SIZE = 128
+
+
+class ResultCache:
+    """LRU キャッシュ. 同じキーの計算が並行して要求された場合は 1 回だけ計算し、結果を共有する."""
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        assert maxsize > 0, 'maxsize must be > 0'
+
+        self._maxsize = maxsize
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, func: Callable[[], object]) -> object:
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+
+        # 他のスレッドが計算中ならその結果を待つ
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._results[key] = result
+            if len(self._results) > self._maxsize:
+                self._results.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def get(self, key: Hashable, default=None) -> object:
+        with self._lock:
+            return self._results.get(key, default)
+
+    def put(self, key: Hashable, value: object) -> None:
+        with self._lock:
+            self._results[key] = value
+            self._results.move_to_end(key)
+            if len(self._results) > self._maxsize:
+                self._results.popitem(last=False)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._results)
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> None:
+        with self._lock:
+            for key in [key for key in self._results if predicate(key)]:
+                del self._results[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._results)
+
+
+class AnalyticsService:
+    """価格データをメモリ上に保持し、分析結果をキャッシュから返す.
+
+    price_loader は analysis.get_price_data_frame と同じシグネチャの関数で、テストではスタブに差し替えられる.
+    """
+
+    def __init__(self,
+                 fund_codes: list,
+                 start_period: datetime.date = None,
+                 end_period: datetime.date = None,
+                 price_loader: Callable[..., pd.DataFrame] = None,
+                 calendar: pd.DatetimeIndex = None,
+                 ffill_limit: int = 0,
+                 min_periods: int = alignment.DEFAULT_MIN_PERIODS,
+                 precompute_periods: Iterable[int] = (DEFAULT_INVESTMENT_PERIOD_DAYS,),
+                 num_frontier_points: int = DEFAULT_NUM_FRONTIER_POINTS,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        self.fund_codes = list(fund_codes)
+        self.start_period = start_period
+        self.end_period = end_period
+        self.precompute_periods = list(precompute_periods)
+        self.num_frontier_points = num_frontier_points
+        self.calendar = calendar
+        self.ffill_limit = ffill_limit
+        self.min_periods = min_periods
+
+        self._price_loader = price_loader
+        self._cache = ResultCache(cache_size)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._df_price = None
+        self._version = 0
+        self._last_version = 0
+
+    def refresh(self) -> None:
+        with self._refresh_lock:
+            if self._price_loader is None:
+                # data.get_reference_price はプロセス内でキャッシュされるので、再取得のためにクリアする
+                data.get_reference_price.cache_clear()
+            self._swap(self._load(self.fund_codes), self.fund_codes)
+
+    def add_fund(self, fund_code: str) -> None:
+        with self._refresh_lock:
+            if fund_code in self.fund_codes:
+                raise ValueError("Fund '{}' is already added.".format(fund_code))
+
+            version, df_price = self._snapshot()
+            ser_new_price = self._load([fund_code])[fund_code]
+            df_price_added = pd.concat([df_price, ser_new_price], axis=1).sort_index()
+
+            # 追加するファンドの日付が既存の日付に含まれるか、カレンダーに揃える場合は既存ファンドの収益率が変わらない.
+            # その場合はキャッシュにある統計量に追加分の行・列だけを足し、全ファンドの再計算を避ける
+            moments = {}
+            if self.calendar is not None or ser_new_price.index.isin(df_price.index).all():
+                for key in self._cache.keys():
+                    if key[:2] != (version, 'moments'):
+                        continue
+                    investment_period_days = key[2]
+                    cached = self._cache.get(key)
+                    if cached is None:
+                        continue
+                    df_new_return = analysis.calc_rate_of_return_from_price(
+                        df_price_added[[fund_code]], investment_period_days, self.calendar, self.ffill_limit)
+                    extended = cached.copy()
+                    extended.add(df_new_return[fund_code])
+                    moments[investment_period_days] = extended
+
+            self._swap(df_price_added, self.fund_codes + [fund_code], moments)
+
+    def price(self) -> pd.DataFrame:
+        return self._snapshot()[1]
+
+    def mean_std(self, investment_period_days: int = DEFAULT_INVESTMENT_PERIOD_DAYS) -> dict:
+        return self._mean_std(*self._snapshot(), investment_period_days)
+
+    def frontier(self,
+                 investment_period_days: int = DEFAULT_INVESTMENT_PERIOD_DAYS,
+                 num_points: int = None,
+                 can_sell_short: bool = False) -> dict:
+        num_points = self.num_frontier_points if num_points is None else num_points
+        if not 2 <= num_points <= MAX_NUM_FRONTIER_POINTS:
+            raise ValueError('num_points must be in [2, {}]. num_points={}'.format(MAX_NUM_FRONTIER_POINTS,
+                                                                                  num_points))
+        return self._frontier(*self._snapshot(), investment_period_days, num_points, can_sell_short)
+
+    def optimize(self,
+                 expected_rate_of_returns: float,
+                 investment_period_days: int = DEFAULT_INVESTMENT_PERIOD_DAYS,
+                 can_sell_short: bool = False) -> dict:
+        version, df_price = self._snapshot()
+
+        def compute():
+            fund_codes, mean, cov, excluded = self._mean_cov(version, df_price, investment_period_days)
+            if not fund_codes:
+                raise RuntimeError('No fund has enough samples. excluded_fund_codes={}'.format(excluded))
+            weights, stddev = analysis.optimize_weights(expected_rate_of_returns, mean, cov, can_sell_short)
+            ret = _portfolio_to_dict(fund_codes, expected_rate_of_returns, weights, stddev)
+            ret['excluded_fund_codes'] = excluded
+            return ret
+
+        key = (version, 'optimize', expected_rate_of_returns, investment_period_days, can_sell_short)
+        return self._cache.get_or_compute(key, compute)
+
+    def _load(self, fund_codes: list) -> pd.DataFrame:
+        if self._price_loader is None:
+            return analysis.get_price_data_frame(fund_codes, self.start_period, self.end_period)
+        return self._price_loader(fund_codes, self.start_period, self.end_period)
+
+    def _swap(self, df_price: pd.DataFrame, fund_codes: list, moments: dict = None) -> None:
+        # 事前計算が失敗した場合に古い価格データで応答し続けられるよう、新しい価格データで計算し終えてから差し替える.
+        # 失敗した試行の結果が残っていても使われないよう、バージョンは試行ごとに振る
+        with self._lock:
+            self._last_version += 1
+            version = self._last_version
+
+        for investment_period_days, pairwise_moments in (moments or {}).items():
+            self._cache.put((version, 'moments', investment_period_days), pairwise_moments)
+
+        for investment_period_days in self.precompute_periods:
+            self._mean_std(version, df_price, investment_period_days)
+            self._frontier(version, df_price, investment_period_days, self.num_frontier_points, False)
+
+        with self._lock:
+            self._df_price = df_price
+            self._version = version
+            self.fund_codes = list(fund_codes)
+        self._cache.discard(lambda key: key[0] != version)
+
+    def _mean_std(self, version: int, df_price: pd.DataFrame, investment_period_days: int) -> dict:
+        def compute():
+            df_return = self._rate_of_return(version, df_price, investment_period_days)
+            df_mean_std = analysis.calc_mean_std_from_return(df_return, self.min_periods)
+            # サンプルの足りないファンドは JSON で扱えるよう NaN を None にする
+            return {fund_code: {'mean': _float_or_none(row['mean']), 'std': _float_or_none(row['std'])}
+                    for fund_code, row in df_mean_std.iterrows()}
+
+        return self._cache.get_or_compute((version, 'mean_std', investment_period_days), compute)
+
+    def _frontier(self,
+                  version: int,
+                  df_price: pd.DataFrame,
+                  investment_period_days: int,
+                  num_points: int,
+                  can_sell_short: bool) -> dict:
+        def compute():
+            fund_codes, mean, cov, excluded = self._mean_cov(version, df_price, investment_period_days)
+            portfolios = []
+            if fund_codes:
+                for expected_rate_of_returns in np.linspace(mean.min(), mean.max(), num_points):
+                    try:
+                        weights, stddev = analysis.optimize_weights(expected_rate_of_returns, mean, cov,
+                                                                    can_sell_short)
+                    except RuntimeError:
+                        # 最適化に失敗した点はフロンティアから除く
+                        continue
+                    portfolios.append(_portfolio_to_dict(fund_codes, expected_rate_of_returns, weights, stddev))
+            return {'portfolios': portfolios, 'excluded_fund_codes': excluded}
+
+        key = (version, 'frontier', investment_period_days, num_points, can_sell_short)
+        return self._cache.get_or_compute(key, compute)
+
+    def _snapshot(self) -> tuple:
+        with self._lock:
+            if self._df_price is None:
+                raise RuntimeError('Price data is not loaded yet. Call refresh() first.')
+            return self._version, self._df_price
+
+    def _rate_of_return(self, version: int, df_price: pd.DataFrame, investment_period_days: int) -> pd.DataFrame:
+        if investment_period_days <= 0:
+            raise ValueError('investment_period_days must be > 0. investment_period_days={}'.format(
+                investment_period_days))
+
+        return self._cache.get_or_compute(
+            (version, 'rate_of_return', investment_period_days),
+            lambda: analysis.calc_rate_of_return_from_price(df_price, investment_period_days,
+                                                            self.calendar, self.ffill_limit))
+
+    def _moments(self,
+                 version: int,
+                 df_price: pd.DataFrame,
+                 investment_period_days: int) -> alignment.PairwiseMoments:
+        return self._cache.get_or_compute(
+            (version, 'moments', investment_period_days),
+            lambda: alignment.PairwiseMoments(self._rate_of_return(version, df_price, investment_period_days)))
+
+    def _mean_cov(self, version: int, df_price: pd.DataFrame, investment_period_days: int) -> tuple:
+        def compute():
+            moments = self._moments(version, df_price, investment_period_days)
+            ser_mean, df_cov, excluded = alignment.calc_mean_cov_from_moments(moments, self.min_periods)
+            return list(ser_mean.index), ser_mean.values, df_cov.values, excluded
+
+        return self._cache.get_or_compute((version, 'mean_cov', investment_period_days), compute)
+
+
+def _portfolio_to_dict(fund_codes: list, expected_rate_of_returns: float, weights: np.ndarray, stddev: float) -> dict:
+    return {
+        'mean': float(expected_rate_of_returns),
+        'std': float(stddev),
+        'weights': {fund_code: float(w) for fund_code, w in zip(fund_codes, weights)}
+    }
+
+
+def _float_or_none(value: float):
+    return None if np.isnan(value) else float(value)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    service = None  # type: AnalyticsService
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        try:
+            if url.path == '/funds':
+                body = self.service.fund_codes
+            elif url.path == '/mean_std':
+                body = self.service.mean_std(_int_param(params, 'investment_period_days',
+                                                        DEFAULT_INVESTMENT_PERIOD_DAYS))
+            elif url.path == '/frontier':
+                body = self.service.frontier(_int_param(params, 'investment_period_days',
+                                                        DEFAULT_INVESTMENT_PERIOD_DAYS),
+                                             _int_param(params, 'num_points', None),
+                                             _bool_param(params, 'can_sell_short'))
+            elif url.path == '/optimize':
+                if 'expected_rate_of_returns' not in params:
+                    raise ValueError('expected_rate_of_returns is required.')
+                body = self.service.optimize(_float_param(params, 'expected_rate_of_returns'),
+                                             _int_param(params, 'investment_period_days',
+                                                        DEFAULT_INVESTMENT_PERIOD_DAYS),
+                                             _bool_param(params, 'can_sell_short'))
+            else:
+                self._send_json(404, {'error': 'Not found: {}'.format(url.path)})
+                return
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except RuntimeError as e:
+            self._send_json(422, {'error': str(e)})
+            return
+        except Exception as e:
+            logging.exception('Failed to handle request: %s', self.path)
+            self._send_json(500, {'error': str(e)})
+            return
+
+        self._send_json(200, body)
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        if url.path == '/funds':
+            if 'fund_code' not in params:
+                self._send_json(400, {'error': 'fund_code is required.'})
+                return
+            if params['fund_code'] in self.service.fund_codes:
+                self._send_json(400, {'error': "Fund '{}' is already added.".format(params['fund_code'])})
+                return
+        elif url.path != '/refresh':
+            self._send_json(404, {'error': 'Not found: {}'.format(url.path)})
+            return
+
+        try:
+            if url.path == '/refresh':
+                self.service.refresh()
+            else:
+                self.service.add_fund(params['fund_code'])
+        except Exception as e:
+            # 取得・事前計算のどちらで失敗しても、保持している価格データは更新されない
+            logging.exception('Failed to update price data.')
+            self._send_json(503, {'error': str(e)})
+            return
+
+        self._send_json(200, {'status': 'ok'})
+
+    def log_message(self, format, *args):
+        logging.info('%s - %s', self.address_string(), format % args)
+
+    def _send_json(self, status: int, body) -> None:
+        try:
+            encoded = json.dumps(body, allow_nan=False).encode('utf8')
+        except ValueError as e:
+            # NaN など JSON で表せない値が残っていた場合
+            logging.exception('Failed to encode response: %s', self.path)
+            status = 500
+            encoded = json.dumps({'error': str(e)}).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+def _int_param(params: dict, name: str, default):
+    if name not in params:
+        return default
+    try:
+        return int(params[name])
+    except ValueError:
+        raise ValueError('{} must be an integer. {}={}'.format(name, name, params[name]))
+
+
+def _float_param(params: dict, name: str) -> float:
+    try:
+        return float(params[name])
+    except ValueError:
+        raise ValueError('{} must be a number. {}={}'.format(name, name, params[name]))
+
+
+def _bool_param(params: dict, name: str) -> bool:
+    return params.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def make_server(service: AnalyticsService, host: str = '127.0.0.1', port: int = 8000) -> HTTPServer:
+    handler = type('RequestHandler', (_RequestHandler,), {'service': service})
+    return _ThreadingHTTPServer((host, port), handler)
+
+
+def serve(fund_codes: list,
+          start_period: datetime.date = None,
+          end_period: datetime.date = None,
+          host: str = '127.0.0.1',
+          port: int = 8000) -> None:
+    service = AnalyticsService(fund_codes, start_period, end_period)
+    service.refresh()
+
+    server = make_server(service, host, port)
+    logging.info('Serving fund analytics on http://{}:{}'.format(host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    serve(sys.argv[1:])
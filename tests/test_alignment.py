@@ -0,0 +1,129 @@
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal, assert_series_equal
+
+from evmoon import alignment, analysis
+
+# 上場日の異なる 3 ファンドの収益率. CCC333 は途中から、BBB222 は途中に欠損がある
+DF_RETURN = pd.DataFrame({'AAA111': [0.010, -0.020, 0.005, 0.012, -0.003, 0.007],
+                          'BBB222': [0.004, np.nan, 0.011, -0.006, 0.002, 0.009],
+                          'CCC333': [np.nan, np.nan, np.nan, 0.003, -0.008, 0.006]},
+                         index=pd.bdate_range('2017-01-04', periods=6))
+
+
+class TestAlignmentPy(unittest.TestCase):
+
+    def test_business_day_calendar(self):
+        # -- exercise --
+        actual = alignment.business_day_calendar(datetime.date(2017, 1, 6),
+                                                 datetime.date(2017, 1, 11),
+                                                 holidays=[datetime.date(2017, 1, 9)])
+
+        # -- verify --
+        expected = pd.DatetimeIndex(['2017-01-06', '2017-01-10', '2017-01-11'])
+        np.testing.assert_array_equal(actual.values, expected.values)
+
+    def test_align_price_data_frame(self):
+        # -- setup --
+        df_price = pd.DataFrame({'AAA111': [100.0, 101.0, np.nan, np.nan, 104.0],
+                                 'BBB222': [np.nan, 200.0, 201.0, np.nan, np.nan]},
+                                index=[datetime.date(2017, 1, 4),
+                                       datetime.date(2017, 1, 5),
+                                       datetime.date(2017, 1, 6),
+                                       datetime.date(2017, 1, 10),
+                                       datetime.date(2017, 1, 11)])
+        calendar = alignment.business_day_calendar(datetime.date(2017, 1, 4), datetime.date(2017, 1, 11))
+
+        # -- exercise --
+        actual_price, actual_observed = alignment.align_price_data_frame(df_price, calendar, ffill_limit=1)
+
+        # -- verify --
+        # 2017-01-09 はカレンダーに含まれるが価格がないので欠損として扱われる
+        expected_price = pd.DataFrame({'AAA111': [100.0, 101.0, 101.0, np.nan, np.nan, 104.0],
+                                       'BBB222': [np.nan, 200.0, 201.0, 201.0, np.nan, np.nan]},
+                                      index=calendar)
+        expected_observed = pd.DataFrame({'AAA111': [True, True, False, False, False, True],
+                                          'BBB222': [False, True, True, False, False, False]},
+                                         index=calendar)
+
+        assert_frame_equal(actual_price, expected_price)
+        assert_frame_equal(actual_observed, expected_observed)
+
+    def test_pairwise_moments(self):
+        # -- exercise --
+        moments = alignment.PairwiseMoments(DF_RETURN)
+        actual_mean, actual_cov = moments.mean(), moments.cov(ddof=1)
+
+        # -- verify --
+        # pandas の DataFrame.cov は pairwise-complete で ddof=1 の共分散を計算する
+        assert_series_equal(actual_mean, DF_RETURN.mean())
+        assert_frame_equal(actual_cov, DF_RETURN.cov())
+
+    def test_calc_mean_cov_for_optimization_non_psd(self):
+        # -- setup --
+        # 欠損の位置がずれているため、pairwise-complete の共分散行列が半正定値にならない
+        df_return = pd.DataFrame({'AAA111': [0.01, 0.02, np.nan, -0.01],
+                                  'BBB222': [0.01, np.nan, 0.02, 0.01],
+                                  'CCC333': [np.nan, 0.02, -0.01, 0.03]})
+        df_pairwise_cov = alignment.PairwiseMoments(df_return).cov()
+        self.assertLess(np.linalg.eigvalsh(df_pairwise_cov.values).min(), 0.0)
+
+        # -- exercise --
+        ser_mean, df_cov, excluded = alignment.calc_mean_cov_for_optimization(df_return)
+
+        # -- verify --
+        self.assertEqual(excluded, [])
+        self.assertGreaterEqual(np.linalg.eigvalsh(df_cov.values).min(), -1e-12)
+        np.testing.assert_array_almost_equal(df_cov.values, df_cov.values.T)
+
+        # 最適化の目的関数が NaN にならない
+        weights, stddev = analysis.optimize_weights(ser_mean.mean(), ser_mean.values, df_cov.values)
+        self.assertTrue(np.isfinite(stddev))
+        self.assertAlmostEqual(weights.sum(), 1.0)
+
+    def test_calc_mean_cov_for_optimization_min_periods(self):
+        # -- setup --
+        # DDD444 は AAA111 と 1 日しか重ならず、EEE555 はサンプルが 1 つしかない
+        df_return = pd.DataFrame({'AAA111': [0.010, -0.020, 0.005, np.nan, np.nan],
+                                  'BBB222': [0.004, 0.003, 0.011, -0.006, 0.002],
+                                  'DDD444': [np.nan, np.nan, 0.007, 0.004, -0.001],
+                                  'EEE555': [np.nan, np.nan, np.nan, np.nan, 0.003]})
+
+        # -- exercise --
+        ser_mean, df_cov, excluded = alignment.calc_mean_cov_for_optimization(df_return, min_periods=2)
+
+        # -- verify --
+        # AAA111 と DDD444 はどちらもサンプル 3 つで NaN も 1 つずつなので、並び順で先の AAA111 が除かれる
+        self.assertEqual(sorted(excluded), ['AAA111', 'EEE555'])
+        self.assertEqual(list(ser_mean.index), ['BBB222', 'DDD444'])
+        self.assertFalse(df_cov.isna().values.any())
+
+    def test_pairwise_moments_add(self):
+        # -- setup --
+        moments = alignment.PairwiseMoments(DF_RETURN[['AAA111', 'BBB222']])
+        ser_new = pd.concat([DF_RETURN['CCC333'], pd.Series([0.001], index=[pd.Timestamp('2017-01-12')])])
+        ser_new.name = 'CCC333'
+
+        # -- exercise --
+        moments.add(ser_new)
+
+        # -- verify --
+        # 追加前のファンドの統計量は変わらず、全ファンドをまとめて計算した場合と一致する
+        expected = alignment.PairwiseMoments(pd.concat([DF_RETURN[['AAA111', 'BBB222']], ser_new], axis=1))
+        self.assertEqual(moments.fund_codes, ['AAA111', 'BBB222', 'CCC333'])
+        assert_frame_equal(moments.counts(), expected.counts())
+        assert_series_equal(moments.mean(), expected.mean())
+        assert_frame_equal(moments.cov(), expected.cov())
+        self.assertAlmostEqual(moments.mean()['AAA111'], DF_RETURN['AAA111'].mean())
+
+    def test_pairwise_moments_add_duplicated_fund(self):
+        moments = alignment.PairwiseMoments(DF_RETURN)
+        with self.assertRaises(ValueError):
+            moments.add(DF_RETURN['AAA111'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ import numpy as np
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
 
-from evmoon import analysis
+from evmoon import alignment, analysis
 
 DATES = [datetime.date(2017, 1, 4),
          datetime.date(2017, 1, 5),
@@ -17,6 +17,7 @@ DATES = [datetime.date(2017, 1, 4),
 REFERENCE_PRICE_1 = [10354.0, 10317.0, 10265.0, 10272.0, 10275.0]
 REFERENCE_PRICE_2 = [11097.0, 11151.0, 11158.0, 11231.0, 11189.0]
 REFERENCE_PRICE_3 = [10911.0, 10954.0, 10986.0, 10970.0, 10953.0]
+REFERENCE_PRICE_4 = [10000.0, 10021.0, 10043.0]     # DATES[2] から上場したファンド
 
 
 def mock_get_reference_price(fund_code: str, start_period=None, end_period=None):
@@ -26,6 +27,8 @@ def mock_get_reference_price(fund_code: str, start_period=None, end_period=None)
         return [{'date': DATES[i], 'reference_price': REFERENCE_PRICE_2[i]} for i in range(0, 5)]
     elif fund_code == 'CCC333':
         return [{'date': DATES[i], 'reference_price': REFERENCE_PRICE_3[i]} for i in range(0, 5)]
+    elif fund_code == 'DDD444':
+        return [{'date': DATES[i + 2], 'reference_price': REFERENCE_PRICE_4[i]} for i in range(0, 3)]
     else:
         return None
 
@@ -94,6 +97,63 @@ class TestAnalysisPy(unittest.TestCase):
 
         assert_frame_equal(actual, expected)
 
+    def test_calc_mean_std_with_younger_fund(self):
+        # -- setup --
+        fund_codes = ['AAA111', 'DDD444']
+        start_period = datetime.date(2017, 1, 4)
+        end_period = datetime.date(2017, 1, 11)
+        investment_period_days = 1
+
+        # -- exercise --
+        actual = analysis.calc_mean_std(fund_codes, start_period, end_period, investment_period_days)
+
+        # -- verify --
+        # 上場日の遅いファンドがあっても、他のファンドは全期間で計算される
+        rate_of_return_1 = [(REFERENCE_PRICE_1[i] - REFERENCE_PRICE_1[i - 1]) / REFERENCE_PRICE_1[i - 1] for i in range(1, 5)]
+        rate_of_return_4 = [(REFERENCE_PRICE_4[i] - REFERENCE_PRICE_4[i - 1]) / REFERENCE_PRICE_4[i - 1] for i in range(1, 3)]
+        expected = pd.DataFrame.from_dict(
+            {'fund_code': ['AAA111', 'DDD444'],
+             'mean': [np.mean(rs) for rs in [rate_of_return_1, rate_of_return_4]],
+             'std': [np.std(rs, ddof=0) for rs in [rate_of_return_1, rate_of_return_4]]}
+        ).set_index('fund_code')
+
+        assert_frame_equal(actual, expected)
+
+    def test_calc_mean_std_from_return_min_periods(self):
+        # -- setup --
+        df_return = pd.DataFrame({'AAA111': [0.010, -0.020, 0.005],
+                                  'DDD444': [np.nan, np.nan, 0.007]})
+
+        # -- exercise --
+        actual = analysis.calc_mean_std_from_return(df_return, min_periods=2)
+
+        # -- verify --
+        # サンプルが 1 つしかない DDD444 は標準偏差 0 ではなく NaN になる
+        expected = pd.DataFrame.from_dict(
+            {'fund_code': ['AAA111', 'DDD444'],
+             'mean': [np.mean([0.010, -0.020, 0.005]), np.nan],
+             'std': [np.std([0.010, -0.020, 0.005], ddof=0), np.nan]}
+        ).set_index('fund_code')
+
+        assert_frame_equal(actual, expected)
+
+    def test_calc_rate_of_return_from_price_with_ffill(self):
+        # -- setup --
+        df_price = pd.DataFrame({'AAA111': [100.0, 101.0, np.nan, np.nan, 104.0, 105.0]},
+                                index=pd.bdate_range('2017-01-04', periods=6))
+
+        # -- exercise --
+        actual = analysis.calc_rate_of_return_from_price(df_price, investment_period_days=1, ffill_limit=2)
+
+        # -- verify --
+        # 埋めた価格で終わる収益率はサンプルに含めず、埋めた価格から始まる収益率は含める
+        expected = pd.DataFrame({'AAA111': [(101.0 - 100.0) / 100.0,
+                                            (104.0 - 101.0) / 101.0,
+                                            (105.0 - 104.0) / 104.0]},
+                                index=df_price.index[[1, 4, 5]])
+        assert_frame_equal(actual, expected)
+        self.assertEqual(alignment.PairwiseMoments(actual).counts().loc['AAA111', 'AAA111'], 3)
+
     # ファンド重み
     WEIGHTS = np.array([0.5, 0.3, 0.2])
 
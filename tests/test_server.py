@@ -0,0 +1,352 @@
+import datetime
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+import mock
+import numpy as np
+import pandas as pd
+
+from evmoon import alignment, analysis, server
+
+DATES = [datetime.date(2017, 1, 4),
+         datetime.date(2017, 1, 5),
+         datetime.date(2017, 1, 6),
+         datetime.date(2017, 1, 10),
+         datetime.date(2017, 1, 11)]
+
+REFERENCE_PRICES = {'AAA111': [10354.0, 10317.0, 10265.0, 10272.0, 10275.0],
+                    'BBB222': [11097.0, 11151.0, 11158.0, 11231.0, 11189.0],
+                    'CCC333': [10911.0, 10954.0, 10986.0, 10970.0, 10953.0],
+                    'DDD444': [10500.0, 10480.0, 10530.0, 10555.0, 10541.0],
+                    'YNG444': [np.nan, np.nan, np.nan, 10000.0, 10012.0]}     # 最近上場したファンド
+
+
+def stub_price_loader(fund_codes: list, start_period=None, end_period=None) -> pd.DataFrame:
+    return pd.DataFrame({fund_code: REFERENCE_PRICES[fund_code] for fund_code in fund_codes}, index=DATES)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_get_or_compute_caches_result(self):
+        # -- setup --
+        cache = server.ResultCache()
+        func = mock.Mock(return_value=42)
+
+        # -- exercise --
+        actual = [cache.get_or_compute('key', func) for _ in range(3)]
+
+        # -- verify --
+        self.assertEqual(actual, [42, 42, 42])
+        self.assertEqual(func.call_count, 1)
+
+    def test_get_or_compute_evicts_least_recently_used(self):
+        # -- setup --
+        cache = server.ResultCache(maxsize=2)
+        cache.get_or_compute('a', lambda: 1)
+        cache.get_or_compute('b', lambda: 2)
+        cache.get_or_compute('a', lambda: 1)      # 'a' を最近使ったことにする
+
+        # -- exercise --
+        cache.get_or_compute('c', lambda: 3)
+
+        # -- verify --
+        func = mock.Mock(return_value=2)
+        self.assertEqual(cache.get_or_compute('a', lambda: None), 1)
+        self.assertEqual(cache.get_or_compute('b', func), 2)
+        self.assertEqual(func.call_count, 1)
+
+    def test_get_or_compute_coalesces_concurrent_requests(self):
+        # -- setup --
+        cache = server.ResultCache()
+        num_threads = 8
+        func = mock.Mock(return_value='result')
+        waiters = threading.Semaphore(0)
+        original_result = server.Future.result
+
+        # 計算中のキーを要求したスレッドは Future.result で待つので、その呼び出しを数える
+        def counting_result(future, timeout=None):
+            waiters.release()
+            return original_result(future, timeout)
+
+        # 他のスレッドがすべて計算中の Future を待ち始めるまで計算を終えない
+        def slow_func():
+            for _ in range(num_threads - 1):
+                if not waiters.acquire(timeout=5):
+                    raise AssertionError('Other requests did not wait for the in-flight computation.')
+            return func()
+
+        results = []
+
+        def request():
+            results.append(cache.get_or_compute('key', slow_func))
+
+        threads = [threading.Thread(target=request) for _ in range(num_threads)]
+
+        # -- exercise --
+        with mock.patch.object(server.Future, 'result', counting_result):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(10)
+
+        # -- verify --
+        self.assertEqual(results, ['result'] * num_threads)
+        self.assertEqual(func.call_count, 1)
+
+    def test_get_or_compute_does_not_cache_exception(self):
+        # -- setup --
+        cache = server.ResultCache()
+        func = mock.Mock(side_effect=[RuntimeError('failed'), 'result'])
+
+        # -- exercise --
+        with self.assertRaises(RuntimeError):
+            cache.get_or_compute('key', func)
+        actual = cache.get_or_compute('key', func)
+
+        # -- verify --
+        self.assertEqual(actual, 'result')
+        self.assertEqual(func.call_count, 2)
+
+
+class TestAnalyticsService(unittest.TestCase):
+
+    FUND_CODES = ['AAA111', 'BBB222', 'CCC333']
+
+    def test_mean_std(self):
+        # -- setup --
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=stub_price_loader, precompute_periods=())
+        service.refresh()
+
+        # -- exercise --
+        actual = service.mean_std(2)
+
+        # -- verify --
+        df_return = analysis.calc_rate_of_return_from_price(stub_price_loader(self.FUND_CODES), 2)
+        expected = analysis.calc_mean_std_from_return(df_return)
+        self.assertEqual(sorted(actual.keys()), self.FUND_CODES)
+        for fund_code in self.FUND_CODES:
+            self.assertAlmostEqual(actual[fund_code]['mean'], expected.loc[fund_code, 'mean'])
+            self.assertAlmostEqual(actual[fund_code]['std'], expected.loc[fund_code, 'std'])
+
+    def test_refresh_precomputes_results(self):
+        # -- setup --
+        loader = mock.Mock(side_effect=stub_price_loader)
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=loader, precompute_periods=(2,),
+                                          num_frontier_points=3)
+
+        # -- exercise --
+        service.refresh()
+
+        # -- verify --
+        # 事前計算済みなので、以降の問い合わせでは再計算されない
+        with mock.patch('evmoon.analysis.calc_mean_std_from_return') as m_mean_std, \
+                mock.patch('evmoon.analysis.optimize_weights') as m_optimize:
+            service.mean_std(2)
+            service.frontier(2)
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(m_mean_std.call_count, 0)
+        self.assertEqual(m_optimize.call_count, 0)
+
+    def test_refresh_invalidates_cache(self):
+        # -- setup --
+        df_updated = stub_price_loader(self.FUND_CODES)
+        df_updated.iloc[-1] = df_updated.iloc[-1] * 1.1
+        prices = [stub_price_loader(self.FUND_CODES), df_updated]
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=mock.Mock(side_effect=prices),
+                                          precompute_periods=())
+        service.refresh()
+        before = service.mean_std(2)
+
+        # -- exercise --
+        service.refresh()
+        after = service.mean_std(2)
+
+        # -- verify --
+        self.assertNotEqual(before, after)
+
+    def test_refresh_precompute_failure(self):
+        # -- setup --
+        df_updated = stub_price_loader(self.FUND_CODES)
+        df_updated.iloc[-1] = df_updated.iloc[-1] * 1.1
+        prices = [stub_price_loader(self.FUND_CODES), df_updated]
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=mock.Mock(side_effect=prices),
+                                          precompute_periods=(2,), num_frontier_points=3)
+        service.refresh()
+        before = service.mean_std(2)
+
+        # -- exercise --
+        # 価格データの取得には成功し、事前計算で失敗する
+        with mock.patch('evmoon.analysis.calc_mean_std_from_return', side_effect=RuntimeError('failed')):
+            with self.assertRaises(RuntimeError):
+                service.refresh()
+
+        # -- verify --
+        # 新しい価格データには差し替わらず、以前の結果で応答し続ける
+        self.assertIs(service.price(), prices[0])
+        self.assertEqual(service.mean_std(2), before)
+
+    def test_younger_fund(self):
+        # -- setup --
+        # YNG444 は価格が 2 つしかないので、investment_period_days=2 の収益率がない
+        service = server.AnalyticsService(self.FUND_CODES + ['YNG444'], price_loader=stub_price_loader,
+                                          precompute_periods=(), num_frontier_points=5)
+        service.refresh()
+
+        # -- exercise --
+        actual_mean_std = service.mean_std(2)
+        actual_frontier = service.frontier(2)
+
+        # -- verify --
+        self.assertEqual(actual_mean_std['YNG444'], {'mean': None, 'std': None})
+        for fund_code in self.FUND_CODES:
+            self.assertIsNotNone(actual_mean_std[fund_code]['mean'])
+
+        # 他のファンドのフロンティアは影響を受けない
+        self.assertEqual(actual_frontier['excluded_fund_codes'], ['YNG444'])
+        self.assertGreater(len(actual_frontier['portfolios']), 0)
+        for portfolio in actual_frontier['portfolios']:
+            self.assertEqual(sorted(portfolio['weights'].keys()), self.FUND_CODES)
+
+        # NaN を含まず JSON として出力できる
+        json.dumps(actual_mean_std, allow_nan=False)
+        json.dumps(actual_frontier, allow_nan=False)
+
+    def test_younger_fund_single_sample(self):
+        # -- setup --
+        # investment_period_days=1 では YNG444 の収益率はサンプル 1 つだけになる
+        service = server.AnalyticsService(self.FUND_CODES + ['YNG444'], price_loader=stub_price_loader,
+                                          precompute_periods=(), num_frontier_points=5)
+        service.refresh()
+
+        # -- exercise --
+        actual_mean_std = service.mean_std(1)
+        actual_frontier = service.frontier(1)
+
+        # -- verify --
+        # 標準偏差 0 のファンドとして扱わず、フロンティアと同じくサンプル不足として扱う
+        self.assertEqual(actual_mean_std['YNG444'], {'mean': None, 'std': None})
+        self.assertEqual(actual_frontier['excluded_fund_codes'], ['YNG444'])
+
+    def test_add_fund(self):
+        # -- setup --
+        loader = mock.Mock(side_effect=stub_price_loader)
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=loader, precompute_periods=(1,),
+                                          num_frontier_points=5)
+        service.refresh()
+
+        # -- exercise --
+        # 追加するファンドの統計量だけを計算し、既存ファンドの統計量は計算し直さない
+        with mock.patch.object(alignment.PairwiseMoments, '__init__', side_effect=AssertionError('recomputed')):
+            service.add_fund('DDD444')
+
+        # -- verify --
+        self.assertEqual(loader.call_args, mock.call(['DDD444'], None, None))
+        self.assertEqual(service.fund_codes, self.FUND_CODES + ['DDD444'])
+
+        # 全ファンドをまとめて読み込んだ場合と一致する
+        expected = server.AnalyticsService(self.FUND_CODES + ['DDD444'], price_loader=stub_price_loader,
+                                           precompute_periods=(1,), num_frontier_points=5)
+        expected.refresh()
+        np.testing.assert_array_almost_equal(
+            [[p['std']] + list(p['weights'].values()) for p in service.frontier(1)['portfolios']],
+            [[p['std']] + list(p['weights'].values()) for p in expected.frontier(1)['portfolios']],
+            decimal=5)
+        self.assertEqual(service.mean_std(1), expected.mean_std(1))
+
+    def test_add_fund_duplicated(self):
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=stub_price_loader, precompute_periods=())
+        service.refresh()
+        with self.assertRaises(ValueError):
+            service.add_fund('AAA111')
+
+    def test_query_before_refresh(self):
+        service = server.AnalyticsService(self.FUND_CODES, price_loader=stub_price_loader)
+        with self.assertRaises(RuntimeError):
+            service.mean_std()
+
+
+class TestHttpServer(unittest.TestCase):
+
+    def setUp(self):
+        self.service = server.AnalyticsService(['AAA111', 'BBB222', 'CCC333'], price_loader=stub_price_loader,
+                                               precompute_periods=())
+        self.service.refresh()
+        self.httpd = server.make_server(self.service, port=0)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def _request(self, path: str, method: str = 'GET') -> tuple:
+        req = urllib.request.Request(self.base_url + path, method=method)
+        try:
+            with urllib.request.urlopen(req) as res:
+                return res.status, json.loads(res.read().decode('utf8'))
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read().decode('utf8'))
+
+    def test_get_mean_std(self):
+        status, body = self._request('/mean_std?investment_period_days=2')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.service.mean_std(2))
+
+    def test_get_invalid_parameter(self):
+        status, body = self._request('/mean_std?investment_period_days=abc')
+        self.assertEqual(status, 400)
+        self.assertIn('error', body)
+
+    def test_get_frontier_too_many_points(self):
+        status, body = self._request('/frontier?num_points={}'.format(server.MAX_NUM_FRONTIER_POINTS + 1))
+        self.assertEqual(status, 400)
+        self.assertIn('num_points', body['error'])
+
+    def test_post_funds(self):
+        status, body = self._request('/funds?fund_code=DDD444', method='POST')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {'status': 'ok'})
+        self.assertIn('DDD444', self.service.fund_codes)
+
+        status, _ = self._request('/funds?fund_code=DDD444', method='POST')
+        self.assertEqual(status, 400)
+
+    def test_get_unknown_path(self):
+        status, _ = self._request('/unknown')
+        self.assertEqual(status, 404)
+
+    def test_post_refresh(self):
+        with mock.patch.object(self.service, 'refresh') as m:
+            status, body = self._request('/refresh', method='POST')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {'status': 'ok'})
+        self.assertEqual(m.call_count, 1)
+
+    def test_post_refresh_loader_failure(self):
+        # -- setup --
+        self.service._price_loader = mock.Mock(side_effect=OSError('connection refused'))
+
+        # -- exercise --
+        status, body = self._request('/refresh', method='POST')
+
+        # -- verify --
+        # 取得に失敗しても、直前の価格データで応答し続ける
+        self.assertEqual(status, 503)
+        self.assertIn('connection refused', body['error'])
+        status, _ = self._request('/mean_std?investment_period_days=2')
+        self.assertEqual(status, 200)
+
+    def test_get_unexpected_error(self):
+        with mock.patch.object(self.service, 'mean_std', side_effect=AssertionError('unexpected')):
+            status, body = self._request('/mean_std')
+        self.assertEqual(status, 500)
+        self.assertEqual(body, {'error': 'unexpected'})
+
+
+if __name__ == '__main__':
+    unittest.main()